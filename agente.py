@@ -3,8 +3,12 @@ from google.adk.models.lite_llm import LiteLlm
 from google.adk.sessions import InMemorySessionService, Session
 from google.adk.memory import InMemoryMemoryService
 from google.adk.runners import Runner
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.genai.types import Content, Part
+from typing import Optional
+import contextlib
 import tools 
+import perfilado
 
 
 APP_NAME = "nutrigym_app"
@@ -32,7 +36,7 @@ FLUJO OBLIGATORIO Y DE PERSISTENCIA:
 3. Acción:
    - Usa `registrar_peso` si el usuario ha proporcionado un peso nuevo o si se acaba de calcular el perfil inicial.
    - Si pide dieta -> `generar_dieta`. 
-   - Si pide rutina -> `generar_rutina` (pregunta días y equipo antes).
+   - Si pide rutina -> `generar_rutina` (pregunta días y equipo antes). Usa variar=True si pide una rutina distinta a la anterior.
    - Si el usuario pide un reporte de progreso o un archivo de datos: usa `generar_reporte_csv`.
    - Para dudas de alimentos: `buscar_alimento_usda`.
    - Para dudas de ejercicios: `buscar_ejercicios`.
@@ -51,7 +55,7 @@ nutri_agent = Agent(
     description="Coach experto en nutrición y fitness, proactivo y basado en datos.",
     instruction=prompt_instrucciones,
     model=LiteLlm(model="ollama_chat/llama3.1:8b"),
-    tools=[
+    tools=[perfilado.perfilar_herramienta(t) for t in [
         tools.calcular_calorias,
         tools.generar_dieta,
         tools.registrar_peso,
@@ -63,17 +67,22 @@ nutri_agent = Agent(
         tools.guardar_perfil,   
         tools.obtener_perfil, 
         tools.generar_reporte_csv
-    ],
+    ]],
 )
 
 
 session_service = InMemorySessionService()
 memory_service = InMemoryMemoryService()
 
-async def chat_nutrigym(user_message: str, session_id: str = "default_session"):
+async def chat_nutrigym(user_message: str, session_id: str = "default_session", perfilar: Optional[bool] = None):
     """
-    Función principal para interactuar con NutriGym con memoria persistente
+    Función principal para interactuar con NutriGym con memoria persistente.
+    Con perfilar=True (o NUTRIGYM_PROFILE=1) escribe una traza por turno en perfiles/.
     """
+    if perfilar is None:
+        perfilar = perfilado.perfilado_activo()
+    perfil = perfilado.PerfilTurno(session_id, user_message) if perfilar else None
+
     if session_id not in session_service.sessions:
         new_session = await session_service.create_session(
             app_name=APP_NAME,
@@ -96,13 +105,19 @@ async def chat_nutrigym(user_message: str, session_id: str = "default_session"):
     print("🤖 NutriGym: ", end="", flush=True)
     
     final_response = ""
+    streaming = StreamingMode.SSE if perfil and perfil.streaming else StreamingMode.NONE
+    if perfil:
+        perfil.activar()
     
     try:
         async for event in runner.run_async(
             user_id=USER_ID, 
             session_id=session_id, 
-            new_message=user_content
+            new_message=user_content,
+            run_config=RunConfig(streaming_mode=streaming)
         ):
+            if perfil:
+                perfil.evento(event)
             if event.is_final_response() and event.content and event.content.parts:
                 final_response = event.content.parts[0].text
                 print(final_response)
@@ -112,15 +127,14 @@ async def chat_nutrigym(user_message: str, session_id: str = "default_session"):
         
         
         try:
-            
-            session = await session_service.get_session(
-                app_name=APP_NAME,
-                user_id=USER_ID,
-                session_id=session_id
-            )
-            
-            
-            await memory_service.add_session_to_memory(session)
+            with perfil.fase("memoria") if perfil else contextlib.nullcontext():
+                session = await session_service.get_session(
+                    app_name=APP_NAME,
+                    user_id=USER_ID,
+                    session_id=session_id
+                )
+                
+                await memory_service.add_session_to_memory(session)
             print(f"💾 Memoria guardada para sesión: {session_id}")
             
         except Exception as mem_error:
@@ -130,6 +144,13 @@ async def chat_nutrigym(user_message: str, session_id: str = "default_session"):
         print(f"\n❌ Error en runner: {e}")
         import traceback
         traceback.print_exc()
+        if perfil:
+            perfil.error = str(e)
         raise
+    finally:
+        if perfil:
+            ruta = perfil.cerrar()
+            if ruta:
+                print(f"⏱️ Traza de perfilado: {ruta}")
     
     return final_response
@@ -77,6 +77,8 @@ if 'session_id' not in st.session_state:
     st.session_state.session_id = f"streamlit_{uuid.uuid4().hex[:8]}"
 if 'conversation_history' not in st.session_state:
     st.session_state.conversation_history = []  # Lista de conversaciones previas
+if 'perfilar' not in st.session_state:
+    st.session_state.perfilar = False
 
 # Sidebar
 with st.sidebar:
@@ -135,6 +137,8 @@ with st.sidebar:
                     st.rerun()
     
     st.markdown("---")
+    st.checkbox("🐞 Modo perfilado (debug)", key="perfilar",
+                help="Guarda una traza JSON por turno con el tiempo de cada fase en la carpeta perfiles/")
     st.caption(f"Session: {st.session_state.session_id[:12]}...")
 
 st.title("💬 Chat con NutriGym")
@@ -164,7 +168,7 @@ if prompt := st.chat_input("Escribe tu mensaje aquí... (ej: Quiero calcular mis
             
             with st.spinner("🤔 NutriGym está pensando..."):
                 response = loop.run_until_complete(
-                    chat_nutrigym(prompt, st.session_state.session_id)
+                    chat_nutrigym(prompt, st.session_state.session_id, st.session_state.perfilar or None)
                 )
             
             loop.close()
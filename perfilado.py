@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import datetime
+import cProfile
+import functools
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+from typing import Optional
+
+# ============================
+#       CONFIGURACIÓN
+# ============================
+# NUTRIGYM_PROFILE=1          activa el perfilado de cada turno de chat_nutrigym
+# NUTRIGYM_PROFILE_DIR        carpeta donde se escriben las trazas JSON (perfiles/)
+# NUTRIGYM_PROFILE_TOOLS      "cprofile" o "muestreo" para perfilar las herramientas
+# NUTRIGYM_PROFILE_STREAM=1   pide respuestas en streaming para separar prompt y generación
+PERFIL_DIR = os.getenv("NUTRIGYM_PROFILE_DIR", "perfiles")
+INTERVALO_MUESTREO = 0.005
+
+FASES = ["llm_prompt", "llm_generacion", "llm", "parseo_argumentos", "herramientas", "memoria", "otros"]
+
+_turno_actual = contextvars.ContextVar("turno_perfilado", default=None)
+
+
+def _env_activo(nombre: str) -> bool:
+    return os.getenv(nombre, "").strip().lower() in ("1", "true", "si", "sí", "yes")
+
+
+def perfilado_activo() -> bool:
+    """Indica si el perfilado está activado por variable de entorno."""
+    return _env_activo("NUTRIGYM_PROFILE")
+
+
+class _Muestreador(threading.Thread):
+    """Toma muestras periódicas de la pila de un hilo en formato 'folded' (a;b;c)."""
+
+    def __init__(self, hilo_id: int):
+        super().__init__(daemon=True)
+        self.hilo_id = hilo_id
+        self.stacks = Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(INTERVALO_MUESTREO):
+            frame = sys._current_frames().get(self.hilo_id)
+            pila = []
+            while frame is not None:
+                codigo = frame.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                frame = frame.f_back
+            if pila:
+                self.stacks[";".join(reversed(pila))] += 1
+
+    def detener(self):
+        self._parar.set()
+        self.join()
+
+
+class PerfilTurno:
+    """
+    Traza de un turno del agente. Cada evento de runner.run_async se marca con
+    su tiempo de llegada y el hueco desde el evento anterior se atribuye a una fase.
+    """
+
+    def __init__(self, session_id: str, mensaje: str):
+        self.session_id = session_id
+        self.mensaje = mensaje
+        self.fecha = datetime.datetime.now()
+        self.streaming = _env_activo("NUTRIGYM_PROFILE_STREAM")
+        self.modo_herramientas = os.getenv("NUTRIGYM_PROFILE_TOOLS", "").strip().lower()
+        self.ruta_base = os.path.join(PERFIL_DIR, f"{session_id}_{self.fecha.strftime('%Y%m%d_%H%M%S_%f')}")
+        self.fases = {fase: 0.0 for fase in FASES}
+        self.eventos = []
+        self.herramientas = []
+        self.error = None
+        self._inicio = time.perf_counter()
+        self._ultimo = self._inicio
+        self._en_stream = False
+        self._token = None
+
+    def _rel(self, t: float) -> float:
+        return round(t - self._inicio, 6)
+
+    def activar(self):
+        """Hace visible este turno para las herramientas envueltas con perfilar_herramienta."""
+        self._token = _turno_actual.set(self)
+        self._ultimo = time.perf_counter()
+
+    def evento(self, event):
+        """Registra un evento de ADK y atribuye el tiempo transcurrido a una fase."""
+        ahora = time.perf_counter()
+        hueco = ahora - self._ultimo
+        llamadas = event.get_function_calls()
+        respuestas = event.get_function_responses()
+
+        if respuestas:
+            ejecutadas = [h for h in self.herramientas if h["_inicio"] >= self._ultimo]
+            registradas = {h["nombre"] for h in ejecutadas}
+            # Si alguna herramienta corrió sin registrarse (p. ej. en un executor que
+            # no hereda el contextvar), no se puede separar el parseo de la ejecución
+            if ejecutadas and all(r.name in registradas for r in respuestas):
+                primera = min(h["_inicio"] for h in ejecutadas)
+                ultima = max(h["_fin"] for h in ejecutadas)
+                self.fases["parseo_argumentos"] += primera - self._ultimo
+                self.fases["herramientas"] += ultima - primera
+            else:
+                self.fases["herramientas"] += hueco
+            fase = "herramientas"
+            self._en_stream = False
+        elif event.author == "user":
+            fase = "otros"
+        elif event.partial:
+            fase = "llm_generacion" if self._en_stream else "llm_prompt"
+            self.fases[fase] += hueco
+            self._en_stream = True
+        else:
+            # Sin streaming no se puede separar el prompt de la generación
+            fase = "llm_generacion" if self._en_stream else "llm"
+            self.fases[fase] += hueco
+            self._en_stream = False
+
+        registro = {
+            "t": self._rel(ahora),
+            "duracion": round(hueco, 6),
+            "fase": fase,
+            "autor": event.author,
+            "parcial": bool(event.partial),
+            "llamadas": [c.name for c in llamadas],
+            "respuestas": [r.name for r in respuestas],
+        }
+        uso = getattr(event, "usage_metadata", None)
+        if uso:
+            registro["tokens_prompt"] = uso.prompt_token_count
+            registro["tokens_respuesta"] = uso.candidates_token_count
+        self.eventos.append(registro)
+        self._ultimo = ahora
+
+    @contextlib.contextmanager
+    def fase(self, nombre: str):
+        """Mide un bloque fuera del runner (por ejemplo, la persistencia en memoria)."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._ultimo = time.perf_counter()
+            self.fases[nombre] += self._ultimo - inicio
+
+    def ejecutar_herramienta(self, func, args, kwargs):
+        """Ejecuta una herramienta midiendo su tiempo y, si se pide, su perfil de CPU."""
+        registro = {"nombre": func.__name__}
+        perfil = muestreador = None
+        # Si el perfilador no puede arrancar (p. ej. ya hay otro activo),
+        # la herramienta se ejecuta igual y solo se mide su tiempo
+        try:
+            if self.modo_herramientas == "cprofile":
+                perfil = cProfile.Profile()
+                perfil.enable()
+            elif self.modo_herramientas == "muestreo":
+                muestreador = _Muestreador(threading.get_ident())
+                muestreador.start()
+        except Exception as e:
+            perfil = muestreador = None
+            registro["error_perfilado"] = str(e)
+
+        registro["_inicio"] = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            registro["_fin"] = time.perf_counter()
+            try:
+                if perfil:
+                    perfil.disable()
+                    os.makedirs(PERFIL_DIR, exist_ok=True)
+                    ruta = f"{self.ruta_base}_{len(self.herramientas)}_{func.__name__}.prof"
+                    perfil.dump_stats(ruta)
+                    registro["cprofile"] = ruta
+                if muestreador:
+                    muestreador.detener()
+                    registro["stacks"] = dict(muestreador.stacks)
+            except Exception as e:
+                registro["error_perfilado"] = str(e)
+            self.herramientas.append(registro)
+
+    def cerrar(self) -> Optional[str]:
+        """Desactiva el turno y escribe la traza JSON. Devuelve la ruta del archivo."""
+        if self._token is not None:
+            _turno_actual.reset(self._token)
+            self._token = None
+
+        total = time.perf_counter() - self._inicio
+        self.fases["otros"] += max(0.0, total - sum(self.fases.values()))
+        herramientas = []
+        for h in self.herramientas:
+            h = dict(h)
+            inicio, fin = h.pop("_inicio"), h.pop("_fin")
+            h.update({"inicio": self._rel(inicio), "fin": self._rel(fin), "duracion": round(fin - inicio, 6)})
+            herramientas.append(h)
+
+        traza = {
+            "session_id": self.session_id,
+            "fecha": self.fecha.isoformat(),
+            "mensaje": self.mensaje,
+            "streaming": self.streaming,
+            "intervalo_muestreo": INTERVALO_MUESTREO,
+            "total": round(total, 6),
+            "fases": {fase: round(t, 6) for fase, t in self.fases.items()},
+            "eventos": self.eventos,
+            "herramientas": herramientas,
+            "error": self.error,
+        }
+        ruta = f"{self.ruta_base}.json"
+        try:
+            os.makedirs(PERFIL_DIR, exist_ok=True)
+            with open(ruta, "w") as f:
+                json.dump(traza, f, indent=4, ensure_ascii=False)
+            return ruta
+        except Exception as e:
+            print(f"⚠️ Advertencia: No se pudo guardar la traza de perfilado: {e}")
+            return None
+
+
+def perfilar_herramienta(func):
+    """
+    Envuelve una herramienta para que se mida cuando hay un turno perfilado activo.
+    Conserva nombre, docstring y firma para que ADK genere el mismo esquema.
+    """
+    @functools.wraps(func)
+    def envoltura(*args, **kwargs):
+        perfil = _turno_actual.get()
+        if perfil is None:
+            return func(*args, **kwargs)
+        return perfil.ejecutar_herramienta(func, args, kwargs)
+    return envoltura
+
+
+def agregar_trazas(directorio: str = PERFIL_DIR) -> str:
+    """
+    Combina las trazas JSON de un directorio en formato 'folded' (una pila por
+    línea con su peso en microsegundos), listo para flamegraph.pl o speedscope.
+    """
+    totales = Counter()
+    for nombre in sorted(os.listdir(directorio)):
+        if not nombre.endswith(".json"):
+            continue
+        with open(os.path.join(directorio, nombre), "r") as f:
+            traza = json.load(f)
+        for fase, t in traza["fases"].items():
+            if fase != "herramientas":
+                totales[f"turno;{fase}"] += int(t * 1e6)
+        intervalo = traza.get("intervalo_muestreo", INTERVALO_MUESTREO)
+        for h in traza["herramientas"]:
+            stacks = h.get("stacks")
+            if stacks:
+                for pila, n in stacks.items():
+                    totales[f"turno;herramientas;{h['nombre']};{pila}"] += int(n * intervalo * 1e6)
+            else:
+                totales[f"turno;herramientas;{h['nombre']}"] += int(h["duracion"] * 1e6)
+    return "\n".join(f"{pila} {peso}" for pila, peso in totales.items() if peso > 0)
+
+
+if __name__ == "__main__":
+    # Uso: python perfilado.py [directorio] > nutrigym.folded
+    print(agregar_trazas(sys.argv[1] if len(sys.argv) > 1 else PERFIL_DIR))
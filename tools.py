@@ -4,7 +4,12 @@ import datetime
 import socket
 import requests
 import copy
+import bisect
+import hashlib
+import random
+import time
 import pandas as pd
+from array import array
 from typing import Optional, List
 from dotenv import load_dotenv
 
@@ -17,6 +22,7 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 API_NINJAS_KEY = os.getenv("API_NINJAS_KEY")
 USDA_API_KEY = os.getenv("USDA_API_KEY")
+RUTINAS_CACHE_TTL_DIAS = float(os.getenv("RUTINAS_CACHE_TTL_DIAS", "7"))
 
 
 # ============================
@@ -111,6 +117,8 @@ def registrar_peso(peso: float):
     except ValueError:
         return {"error": "El peso debe ser numérico."}
 
+    firma_previa = _firma_archivo(file)
+
     # Cargar o crear archivo
     if os.path.exists(file):
         try:
@@ -121,14 +129,20 @@ def registrar_peso(peso: float):
     else:
         data = {"peso": []}
 
-    data["peso"].append({
+    registro = {
         "fecha": datetime.datetime.now().isoformat(),
         "peso": peso
-    })
+    }
+    data["peso"].append(registro)
 
     with open(file, "w") as f:
         json.dump(data, f, indent=4)
 
+    # Si el historial en memoria estaba al día, se amplía en lugar de releerlo
+    if _historial_peso["datos"] is not None and _historial_peso["firma"] == (file, firma_previa):
+        _historial_peso["datos"].agregar(registro)
+        _historial_peso["firma"] = (file, _firma_archivo(file))
+
     return {"status": "OK", "registrado": peso}
 
 
@@ -145,15 +159,140 @@ def obtener_progreso(limite: int):
         limite = 5
     
     try:
-        with open(file, "r") as f:
-            data = json.load(f)
-            registros = data.get("peso", [])
-            if not registros: 
-                return {"error": "Archivo vacío."}
-            return {"progreso": registros[-limite:], "total": len(registros)}
+        historial = cargar_historial_peso(file)
+        if not historial: 
+            return {"error": "Archivo vacío."}
+        inicio = max(0, len(historial) - max(0, limite))
+        return {"progreso": historial.registros(inicio, len(historial)), "total": len(historial)}
     except:
         return {"error": "Error leyendo el archivo."}
 
+
+class HistorialPeso:
+    """
+    Historial de peso en memoria compacta: dos arrays paralelos de tipo 'd'
+    con la fecha (segundos desde 1970-01-01, hora local sin zona) y el peso.
+
+    Los registros que no se pueden reconstruir exactamente desde los arrays
+    (fechas con zona horaria o no ISO, peso no float, claves extra) se guardan
+    tal cual en `originales`, así que a_json() reproduce el archivo sin cambios.
+    Esas fechas quedan como NaN y no entran en las consultas por rango.
+    Si las fechas están en orden cronológico (lo normal con registrar_peso),
+    rango() usa bisect y devuelve memoryviews sin copia; si no, filtra
+    recorriendo el historial y devuelve arrays nuevos.
+    """
+
+    _EPOCH = datetime.datetime(1970, 1, 1)
+
+    def __init__(self):
+        self.fechas = array("d")
+        self.pesos = array("d")
+        self.originales = {}
+        self.ordenado = True
+
+    def __len__(self):
+        return len(self.pesos)
+
+    @classmethod
+    def _a_epoch(cls, fecha) -> Optional[float]:
+        """Segundos desde 1970 para una fecha ISO sin zona; None si no lo es."""
+        if not isinstance(fecha, str):
+            return None
+        try:
+            dt = datetime.datetime.fromisoformat(fecha)
+        except ValueError:
+            return None
+        if dt.tzinfo is not None:
+            return None
+        return (dt - cls._EPOCH) / datetime.timedelta(seconds=1)
+
+    @classmethod
+    def _a_iso(cls, ts: float) -> str:
+        return (cls._EPOCH + datetime.timedelta(seconds=ts)).isoformat()
+
+    @classmethod
+    def desde_json(cls, data: dict):
+        """Construye el historial a partir del formato de progreso.json."""
+        historial = cls()
+        for r in data.get("peso", []):
+            historial.agregar(r)
+        return historial
+
+    def agregar(self, registro):
+        """Añade un registro con el formato de progreso.json al final del historial."""
+        es_dict = isinstance(registro, dict)
+        valor = registro.get("peso") if es_dict else None
+        ts = self._a_epoch(registro.get("fecha")) if es_dict else None
+
+        exacto = (es_dict and registro.keys() == {"fecha", "peso"} and type(valor) is float
+                  and ts is not None and self._a_iso(ts) == registro["fecha"])
+        if not exacto:
+            self.originales[len(self)] = copy.deepcopy(registro)
+
+        if ts is None:
+            ts = float("nan")
+            self.ordenado = False
+        elif self.ordenado and len(self) and ts < self.fechas[-1]:
+            self.ordenado = False
+        numerico = isinstance(valor, (int, float)) and not isinstance(valor, bool)
+        self.fechas.append(ts)
+        self.pesos.append(float(valor) if numerico else float("nan"))
+
+    def registro(self, i: int):
+        """Registro i con el mismo contenido que tiene en progreso.json."""
+        if i in self.originales:
+            return copy.deepcopy(self.originales[i])
+        return {"fecha": self._a_iso(self.fechas[i]), "peso": self.pesos[i]}
+
+    def registros(self, inicio: int, fin: int) -> list:
+        """Registros [inicio, fin) con el mismo contenido que tienen en progreso.json."""
+        return [self.registro(i) for i in range(inicio, fin)]
+
+    def a_json(self) -> dict:
+        """Devuelve el historial con el mismo formato que progreso.json."""
+        return {"peso": self.registros(0, len(self))}
+
+    def ultimos(self, n: int):
+        """Vistas (fechas, pesos) de los últimos n registros del archivo, sin copiar."""
+        inicio = max(0, len(self) - max(0, n))
+        return memoryview(self.fechas)[inicio:], memoryview(self.pesos)[inicio:]
+
+    def rango(self, desde: Optional[str] = None, hasta: Optional[str] = None):
+        """(fechas, pesos) de los registros entre dos fechas ISO sin zona (ambas incluidas)."""
+        inicio = self._a_epoch(desde) if desde else float("-inf")
+        fin = self._a_epoch(hasta) if hasta else float("inf")
+        if inicio is None or fin is None:
+            raise ValueError("Las fechas del rango deben ser ISO sin zona horaria.")
+        if not self.ordenado:
+            indices = [i for i, ts in enumerate(self.fechas) if inicio <= ts <= fin]
+            return array("d", (self.fechas[i] for i in indices)), array("d", (self.pesos[i] for i in indices))
+        i = bisect.bisect_left(self.fechas, inicio)
+        j = bisect.bisect_right(self.fechas, fin)
+        return memoryview(self.fechas)[i:j], memoryview(self.pesos)[i:j]
+
+
+# Historial en memoria; se reconstruye solo si cambia el archivo
+_historial_peso = {"firma": None, "datos": None}
+
+
+def _firma_archivo(file: str):
+    try:
+        st = os.stat(file)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def cargar_historial_peso(file: str = "progreso.json") -> HistorialPeso:
+    """Devuelve progreso.json como HistorialPeso, releyéndolo solo si cambió."""
+    firma = (file, _firma_archivo(file))
+    if _historial_peso["datos"] is not None and _historial_peso["firma"] == firma:
+        return _historial_peso["datos"]
+    with open(file, "r") as f:
+        historial = HistorialPeso.desde_json(json.load(f))
+    _historial_peso.update(firma=firma, datos=historial)
+    return historial
+
 # ============================
 # TOOL 4: Nutrición (Dieta y USDA)
 # ============================
@@ -224,48 +363,229 @@ def buscar_ejercicios(musculo: Optional[str], tipo: Optional[str], dificultad: O
         return {"error": str(e)}
 
 
-def generar_rutina(objetivo: str, nivel: str, dias_semana: int, equipo_disponible: Optional[List[str]]):
-    """Genera rutina llamando a buscar_ejercicios internamente."""
-    
-    # Manejar valores por defecto dentro de la función
-    if not nivel:
-        nivel = "beginner"
-    if not dias_semana:
-        dias_semana = 3
-    
-    rutinas_base = {
-        "fuerza": ["chest", "back", "legs", "shoulders"],
-        "hipertrofia": ["chest", "back", "legs", "shoulders", "biceps", "triceps"],
-        "resistencia": ["cardio", "full_body"],
-        "perdida_peso": ["cardio", "legs", "back"]
+RUTINAS_BASE = {
+    "fuerza": ["chest", "back", "legs", "shoulders"],
+    "hipertrofia": ["chest", "back", "legs", "shoulders", "biceps", "triceps"],
+    "resistencia": ["cardio", "full_body"],
+    "perdida_peso": ["cardio", "legs", "back"]
+}
+
+# Ejercicios guardados por consulta; la rutina elige 3 de cada pool
+RUTINAS_CACHE_FILE = "rutinas_cache.json"
+RUTINAS_STATS_FILE = "rutinas_cache_stats.json"
+POOL_EJERCICIOS = 10
+
+# Copia en memoria de rutinas_cache.json; se relee solo si el archivo cambia
+_cache_rutinas = {"mtime": None, "datos": None}
+
+
+def _normalizar_rutina(objetivo: str, nivel: str, dias_semana: int, equipo_disponible: Optional[List[str]]):
+    """Reduce los parámetros de generar_rutina a la tupla usada como clave de caché."""
+    obj = objetivo.strip().lower() if objetivo else ""
+    if obj not in RUTINAS_BASE:
+        obj = "resistencia"
+    nivel = nivel.strip().lower() if nivel else "beginner"
+    dias = max(1, min(int(dias_semana or 3), 7))
+    eq = equipo_disponible[0].strip().lower() if equipo_disponible and equipo_disponible[0] else ""
+    return obj, nivel, dias, eq
+
+
+def _cargar_cache_rutinas():
+    """Devuelve {"pools": {...}, "planes": {...}}; un archivo con otra forma se ignora."""
+    mtime = os.path.getmtime(RUTINAS_CACHE_FILE) if os.path.exists(RUTINAS_CACHE_FILE) else None
+    if mtime is not None and mtime == _cache_rutinas["mtime"]:
+        return _cache_rutinas["datos"]
+
+    datos = {}
+    if mtime is not None:
+        try:
+            with open(RUTINAS_CACHE_FILE, "r") as f:
+                datos = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            pass
+    if not isinstance(datos, dict):
+        datos = {}
+    cache = {
+        "pools": datos["pools"] if isinstance(datos.get("pools"), dict) else {},
+        "planes": datos["planes"] if isinstance(datos.get("planes"), dict) else {}
     }
-    
-    grupo_obj = rutinas_base.get(objetivo.lower(), rutinas_base["resistencia"])
+    _cache_rutinas.update(mtime=mtime, datos=cache)
+    return cache
+
+
+def _guardar_cache_rutinas(cache: dict):
+    try:
+        with open(RUTINAS_CACHE_FILE, "w") as f:
+            json.dump(cache, f)
+        _cache_rutinas.update(mtime=os.path.getmtime(RUTINAS_CACHE_FILE), datos=cache)
+    except Exception:
+        pass  # La caché es opcional; la rutina ya está generada
+
+
+def _cargar_estadisticas_rutinas():
+    try:
+        with open(RUTINAS_STATS_FILE, "r") as f:
+            stats = json.load(f)
+        return {"hits": int(stats.get("hits", 0)), "misses": int(stats.get("misses", 0))}
+    except Exception:
+        return {"hits": 0, "misses": 0}
+
+
+def _registrar_estadistica_rutinas(acierto: bool):
+    stats = _cargar_estadisticas_rutinas()
+    stats["hits" if acierto else "misses"] += 1
+    try:
+        with open(RUTINAS_STATS_FILE, "w") as f:
+            json.dump(stats, f)
+    except Exception:
+        pass
+
+
+def _pool_valido(pool: Optional[dict]) -> bool:
+    return (isinstance(pool, dict) and "ejercicios" in pool and "hash" in pool
+            and isinstance(pool.get("fecha"), (int, float)))
+
+
+def _pool_vigente(pool: Optional[dict], ahora: float) -> bool:
+    return _pool_valido(pool) and ahora - pool["fecha"] < RUTINAS_CACHE_TTL_DIAS * 86400
+
+
+def _obtener_pool(cache: dict, grupo: str, nivel: str, eq: str, ahora: float):
+    """
+    Devuelve (clave, pool, consulto_api, nuevo) para un grupo muscular. Si el pool
+    caducó se vuelve a pedir a la API; si la API falla se usa el anterior.
+    """
+    tipo = "cardio" if grupo == "cardio" else "strength"
+    clave = f"{grupo}|{tipo}|{nivel}|{eq}"
+    pool = cache["pools"].get(clave)
+    if _pool_vigente(pool, ahora):
+        return clave, pool, False, False
+
+    res = buscar_ejercicios(
+        musculo=grupo if grupo != "cardio" else None,
+        tipo=tipo,
+        dificultad=nivel,
+        equipo=eq or None,
+        nombre=None,
+        limite=POOL_EJERCICIOS
+    )
+    if "ejercicios" in res:
+        pool = {
+            "ejercicios": res["ejercicios"],
+            "hash": hashlib.sha1(json.dumps(res["ejercicios"], sort_keys=True).encode()).hexdigest(),
+            "fecha": ahora
+        }
+        cache["pools"][clave] = pool
+        return clave, pool, True, True
+    if not _pool_valido(pool):
+        pool = None
+    return clave, pool, True, False
+
+
+def _plan_vigente(cache: dict, entrada: Optional[dict], ahora: float) -> bool:
+    """Un plan sigue valiendo si todos sus pools están vigentes y no han cambiado."""
+    if not isinstance(entrada, dict) or "plan" not in entrada or not isinstance(entrada.get("pools"), dict):
+        return False
+    for clave, hash_pool in entrada["pools"].items():
+        pool = cache["pools"].get(clave)
+        if not _pool_vigente(pool, ahora) or pool["hash"] != hash_pool:
+            return False
+    return True
+
+
+def _resolver_rutina(obj: str, nivel: str, dias: int, eq: str, variar: bool):
+    """
+    Devuelve (rutina, acierto) para parámetros ya normalizados. Es acierto si no
+    hubo que consultar la API. Solo reescribe la caché si cambian pools o planes.
+    """
+    clave_plan = f"{obj}|{nivel}|{dias}|{eq}"
+    cache = _cargar_cache_rutinas()
+    ahora = time.time()
+
+    entrada = cache["planes"].get(clave_plan)
+    if not variar and _plan_vigente(cache, entrada, ahora):
+        return copy.deepcopy(entrada["plan"]), True
+
+    grupo_obj = RUTINAS_BASE[obj]
     rutina = []
-    
-    # Limitamos los días a 7
-    dias = max(1, min(int(dias_semana), 7))
-    eq = equipo_disponible[0] if equipo_disponible else None
+    pools_usados = {}
+    consulto_api = False
+    cambio = False
+    completo = True
 
     for i in range(dias):
         grupo = grupo_obj[i % len(grupo_obj)]  # Ciclar grupos musculares
-        res = buscar_ejercicios(
-            musculo=grupo if grupo != "cardio" else None, 
-            tipo="cardio" if grupo == "cardio" else "strength",
-            dificultad=nivel, 
-            equipo=eq,
-            nombre=None,
-            limite=3
-        )
-        
+        clave_pool, pool, consulto, nuevo = _obtener_pool(cache, grupo, nivel, eq, ahora)
+        consulto_api = consulto_api or consulto
+        cambio = cambio or nuevo
+        if pool:
+            pools_usados[clave_pool] = pool["hash"]
+            ejercicios = pool["ejercicios"]
+            if variar:
+                ejercicios = random.sample(ejercicios, min(3, len(ejercicios)))
+            else:
+                ejercicios = ejercicios[:3]
+        else:
+            completo = False
+            ejercicios = []
+
         rutina.append({
             "dia": i + 1,
             "enfoque": grupo,
-            "ejercicios": res.get("ejercicios", [])
+            "ejercicios": ejercicios
         })
-        
+
+    if completo and not variar:
+        nueva = {"plan": rutina, "pools": pools_usados}
+        if cache["planes"].get(clave_plan) != nueva:
+            cache["planes"][clave_plan] = copy.deepcopy(nueva)
+            cambio = True
+    if cambio:
+        _guardar_cache_rutinas(cache)
+
+    # Copia para que quien llama no modifique los pools guardados en memoria
+    return copy.deepcopy(rutina), not consulto_api
+
+
+def generar_rutina(objetivo: str, nivel: str, dias_semana: int, equipo_disponible: Optional[List[str]],
+                   variar: Optional[bool]):
+    """
+    Genera rutina a partir de ejercicios de buscar_ejercicios, usando la caché
+    de rutinas_cache.json. Con variar=True elige ejercicios al azar del pool guardado.
+    """
+    obj, nivel, dias, eq = _normalizar_rutina(objetivo, nivel, dias_semana, equipo_disponible)
+    rutina, acierto = _resolver_rutina(obj, nivel, dias, eq, bool(variar))
+    _registrar_estadistica_rutinas(acierto)
     return {"plan": rutina}
 
+
+def precalcular_rutinas(equipos: Optional[List[str]]):
+    """
+    Materializa en la caché todas las rutinas (objetivo, nivel, días) para
+    los equipos indicados. Solo consulta la API para los pools que falten
+    y no cuenta en las estadísticas de aciertos.
+    """
+    equipos = equipos or [""]
+    total = 0
+    for obj in RUTINAS_BASE:
+        for nivel in ("beginner", "intermediate", "expert"):
+            for dias in range(1, 8):
+                for eq in equipos:
+                    _resolver_rutina(obj, nivel, dias, eq.strip().lower(), False)
+                    total += 1
+    return {"status": "Caché de rutinas generada", "rutinas": total}
+
+
+def estadisticas_cache_rutinas():
+    """Devuelve aciertos, fallos y tasa de acierto de la caché de rutinas."""
+    stats = _cargar_estadisticas_rutinas()
+    total = stats["hits"] + stats["misses"]
+    return {
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "hit_rate": round(stats["hits"] / total, 3) if total else 0.0
+    }
+
 # ============================
 # TOOL 6: Persistencia de Perfil
 # ============================
@@ -315,10 +635,8 @@ def generar_reporte_csv():
         return {"error": "No hay registros de peso para generar el reporte."}
         
     try:
-        with open(progreso_file, "r") as f:
-            progreso_data = json.load(f)
-        registros = progreso_data.get("peso", [])
-        if not registros:
+        historial = cargar_historial_peso(progreso_file)
+        if not historial:
             return {"error": "El archivo de progreso está vacío."}
     except Exception as e:
         return {"error": f"Error al leer el progreso: {str(e)}"}
@@ -335,7 +653,7 @@ def generar_reporte_csv():
             pass  # Ignoramos el error si el perfil está corrupto
 
     # 3. Crear el DataFrame
-    df = pd.DataFrame(registros)
+    df = pd.DataFrame(historial.a_json()["peso"])
     
     # Añadir los metadatos del perfil como filas iniciales
     metadata = pd.DataFrame({
@@ -350,6 +668,14 @@ def generar_reporte_csv():
     reporte_nombre = "reporte_progreso.csv"
     try:
         df_final.to_csv(reporte_nombre, index=False, encoding='utf-8')
-        return {"status": "Reporte generado", "archivo": reporte_nombre, "registros_exportados": len(registros)}
+        return {"status": "Reporte generado", "archivo": reporte_nombre, "registros_exportados": len(historial)}
     except Exception as e:
         return {"error": f"Fallo al escribir el CSV: {str(e)}"}
+
+
+if __name__ == "__main__":
+    # Uso: python tools.py precalcular [equipo ...]  |  python tools.py estadisticas
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "precalcular":
+        print(json.dumps(precalcular_rutinas(sys.argv[2:]), indent=4))
+    print(json.dumps(estadisticas_cache_rutinas(), indent=4))